@@ -5,6 +5,9 @@ BATTERY_FIRMWARE_URL = (
     "/assets/battery/PCBv{pcb_version}/firmware/{resource}"
 ) 
 
+# the latest firmware version available is cached here, and revalidated with the server (ETag)
+BATTERY_FIRMWARE_INDEX_CACHE = "~/.cache/duckietown/fw_latest_pcb{pcb_version}.json"
+
 # in the helper, these env variables help configure some options
 ENV_KEY_FORCE_FW_VERSION = "FORCE_BATTERY_FW_VERSION"
 ENV_KEY_PCB_VERSION = "PCB_VERSION"
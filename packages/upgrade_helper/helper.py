@@ -1,30 +1,24 @@
+import json
 import os
 import re
 import subprocess
 import sys
-import time
+import tempfile
 import traceback
-from threading import Thread
-from typing import List, Optional, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock, Thread
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple, Union
 
-import requests
-import serial
 from dt_class_utils import DTProcess
-from serial.tools.list_ports import grep as serial_grep
-
-from battery_drivers import Battery
-from battery_drivers.constants import (
-    BATTERY_PCB16_BOOT_VID as BATTERY_PCB_BOOT_VID,
-    BATTERY_PCB16_BOOT_PID as BATTERY_PCB_BOOT_PID,
-    BATTERY_PCB16_READY_VID as BATTERY_PCB_READY_VID,
-    BATTERY_PCB16_READY_PID as BATTERY_PCB_READY_PID,
-    BATTERY_PCB16_BAUD_RATE as BATTERY_PCB_BAUD_RATE,
-)
+
+# NOTE: requests, serial and battery_drivers are imported where they are used, so that
+#       the CLI starts fast when it does not need them (e.g. --help)
 from . import __version__
 from .constants import (
     ExitCode,
     BatteryMode,
     BATTERY_FIRMWARE_URL,
+    BATTERY_FIRMWARE_INDEX_CACHE,
     LOCAL_FIRMWARE_BIN_PATH,
     PCB_VERSION_ID_EXIT_CODE_NONE,
     ENV_KEY_FORCE_FW_VERSION,
@@ -43,12 +37,64 @@ Duckietown Battery:
     - Available version: {latest}
 """
 
+# used to turn version strings (e.g. "v1.2.3") into comparable ints (e.g. 123)
+_NONDIGIT_RE = re.compile(r"[^0-9]+")
+
+# seconds to wait for the battery to report its info
+BATTERY_INFO_TIMEOUT = 10
+
+# prefix of the lines reporting the exit code of each command in --serve mode
+SERVE_RESULT_PREFIX = "RESULT"
+
+# one HTTP session shared by all requests, reuses the connection to the firmware server
+_SESSION = None
+_SESSION_LOCK = Lock()
+# (connect, read) timeouts in seconds, pass it to every request.
+# With retries, a request can take up to 4 x (5 + 30) seconds plus backoff
+HTTP_TIMEOUT = (5, 30)
+# where downloaded firmware binaries are stored, in order of preference
+FIRMWARE_DOWNLOAD_DIRS = ["/dev/shm", "/tmp"]
+# multipart download of firmware binaries (same defaults as S3's TransferConfig)
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+DOWNLOAD_MAX_CONCURRENCY = 8
+
+
+class ModeDetectResult(NamedTuple):
+    # outcome of the battery mode detection, exactly one of the two fields is set
+    exit_code: Optional[ExitCode]
+    device: Optional[str]
+
+
+def _session():
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            session = requests.Session()
+            session.mount("https://", HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=8,
+                max_retries=Retry(
+                    total=3,
+                    backoff_factor=0.3,
+                    status_forcelist=[500, 502, 503, 504],
+                    allowed_methods=["GET", "HEAD"],
+                ),
+            ))
+            _SESSION = session
+        return _SESSION
+
 
 class UpgradeHelper(DTProcess):
 
     def __init__(self):
         super(UpgradeHelper, self).__init__("UpgradeHelper")
         self._battery_info = None
+        # latest firmware available, by PCB version: {pcb_version: (latest_int, latest_str)}
+        self._latest_fw: Dict[int, Tuple[int, str]] = {}
 
     def start(self, parsed) -> int:
         # nothing to do?
@@ -60,24 +106,64 @@ class UpgradeHelper(DTProcess):
             version=__version__
         ))
         sys.stdout.flush()
-        # upgrade battery
-        if parsed.battery:
-            if parsed.find_pcbid:
-                return self.battery_find_pcb_version()
-            if parsed.check:
-                return self.battery_check_firmware_up_to_date()
-            # try to flash firmware
-            return self.upgrade_battery(
-                parsed.dry_run,
-                parsed.use_local_firmware,
-            )
         # upgrade hut
-        if parsed.hut:
+        if not parsed.battery:
             return self.upgrade_hut(parsed.check, parsed.dry_run)
+        # upgrade battery
+        if parsed.serve:
+            return self.serve(parsed)
+        if parsed.find_pcbid:
+            return self.battery_find_pcb_version()
+        if parsed.check:
+            return self.battery_check_firmware_up_to_date()
+        # try to flash firmware
+        return self.upgrade_battery(
+            parsed.dry_run,
+            parsed.use_local_firmware,
+        )
+
+    def serve(self, parsed) -> int:
+        """Handle battery commands read from stdin, one per line, until `quit` or EOF
+
+        Battery info and latest firmware versions are cached between commands, so
+        running find-pcbid, check and upgrade in sequence talks to the battery and
+        the firmware server only once, and upgrade does not need the PCB_VERSION env
+        variable if the PCB version was read before. The battery info is dropped after
+        a successful flash, so a following check reads the new firmware version.
+        The exit code of each command is written to stdout as a line
+        `RESULT <command> <exit code>`, the prefix tells it apart from the other
+        output (e.g. the battery info printed by check).
+
+        Returns:
+            int: ExitCode.SUCCESS once the input is exhausted.
+        """
+        handlers = {
+            "find-pcbid": self.battery_find_pcb_version,
+            "check": self.battery_check_firmware_up_to_date,
+            "upgrade": lambda: self.upgrade_battery(parsed.dry_run, parsed.use_local_firmware),
+        }
+        for line in sys.stdin:
+            if self.is_shutdown():
+                break
+            command = line.strip()
+            if not command:
+                continue
+            if command == "quit":
+                break
+            handler = handlers.get(command)
+            if handler is None:
+                self.logger.error(f"Unknown command '{command}'. "
+                                  f"Valid commands are: {', '.join(handlers)}, quit.")
+                res = ExitCode.GENERIC_ERROR
+            else:
+                res = handler()
+            sys.stdout.write(f"{SERVE_RESULT_PREFIX} {command} {int(res)}\n")
+            sys.stdout.flush()
+        return ExitCode.SUCCESS
 
     def _battery_device_mode_detect(self,
                                    mode_required: BatteryMode,
-                                   ) -> Union[int, str]:
+                                   ) -> ModeDetectResult:
         """Detect battery device address
 
         battery needs to be:
@@ -88,19 +174,29 @@ class UpgradeHelper(DTProcess):
             mode_required (BatteryMode): the battery is expected in READY or BOOT mode
 
         Returns:
-            Union[int, str]: If success, the device port, e.g. "/dev/ttyUSB0".
-                             Otherwise, return an int defined in ExitCode class.
+            ModeDetectResult: If success, the device port, e.g. "/dev/ttyUSB0", in `device`.
+                              Otherwise, the ExitCode in `exit_code`.
         """
 
-        ready_devs = self._find_device(BATTERY_PCB_READY_VID, BATTERY_PCB_READY_PID)
-        boot_devs = self._find_device(BATTERY_PCB_BOOT_VID, BATTERY_PCB_BOOT_PID)
+        from battery_drivers.constants import (
+            BATTERY_PCB16_BOOT_VID as BATTERY_PCB_BOOT_VID,
+            BATTERY_PCB16_BOOT_PID as BATTERY_PCB_BOOT_PID,
+            BATTERY_PCB16_READY_VID as BATTERY_PCB_READY_VID,
+            BATTERY_PCB16_READY_PID as BATTERY_PCB_READY_PID,
+        )
+
+        ready_vidpid = (BATTERY_PCB_READY_VID, BATTERY_PCB_READY_PID)
+        boot_vidpid = (BATTERY_PCB_BOOT_VID, BATTERY_PCB_BOOT_PID)
+        devs = self._list_ports_by_vidpid({ready_vidpid, boot_vidpid})
+        ready_devs = devs[ready_vidpid]
+        boot_devs = devs[boot_vidpid]
         # no battery at all?
         if len(boot_devs) + len(ready_devs) <= 0:
             self.logger.error((
                 "Battery not detected. "
                 "Please check the connection to the battery and retry."
             ))
-            return ExitCode.HARDWARE_NOT_FOUND
+            return ModeDetectResult(ExitCode.HARDWARE_NOT_FOUND, None)
 
         # check if mode correct
         if mode_required == BatteryMode.READY:
@@ -109,19 +205,19 @@ class UpgradeHelper(DTProcess):
                 self.logger.error("Battery detected in 'Boot Mode', but it needs to be in "
                                   "'Normal Mode'. You can switch mode by pressing the button "
                                   "on the battery ONCE.")
-                return ExitCode.HARDWARE_WRONG_MODE
-            return ready_devs[0]
+                return ModeDetectResult(ExitCode.HARDWARE_WRONG_MODE, None)
+            return ModeDetectResult(None, ready_devs[0])
         elif mode_required == BatteryMode.BOOT:
             if len(boot_devs) < 1:
                 # battery found but NOT in BOOT mode
                 self.logger.error("Battery detected in 'Normal Mode', but it needs to be in "
                                 "'Boot Mode'. You can switch mode by DOUBLE pressing the button "
                                 "on the battery.")
-                return ExitCode.HARDWARE_WRONG_MODE
-            return boot_devs[0]
+                return ModeDetectResult(ExitCode.HARDWARE_WRONG_MODE, None)
+            return ModeDetectResult(None, boot_devs[0])
         else:
             self.logger.error(f"Invalid mode given: {mode_required}. This is most likely a bug in the code.")
-            return ExitCode.GENERIC_ERROR
+            return ModeDetectResult(ExitCode.GENERIC_ERROR, None)
 
     def _battery_obtain_info(self) -> int:
         """Obtain battery related information
@@ -139,29 +235,49 @@ class UpgradeHelper(DTProcess):
 
         # battery needs to be in READY mode for info/version reading
         res = self._battery_device_mode_detect(mode_required=BatteryMode.READY)
-        if isinstance(res, int):  # if an ExitCode is returned
-            return res
-        # else, res is the ready mode device address
+        if res.exit_code is not None:
+            return res.exit_code
+        # else, res.device is the ready mode device address
+
+        import serial
+        from battery_drivers import Battery
 
         # battery READY. spin battery drivers and wait for info to be read
-        battery = Battery(lambda _: None, logger=self.logger)
+        info_ready = Event()
+
+        def on_battery_data(_):
+            if battery.info is not None:
+                info_ready.set()
+
+        battery = Battery(on_battery_data, logger=self.logger)
         self.register_shutdown_callback(battery.shutdown)
+        self.register_shutdown_callback(info_ready.set)
 
-        def watchdog_fcn():
-            timeout, elapsed, step = 10, 0, 0.5
-            while not (self.is_shutdown() or battery.is_shutdown()) and battery.info is None:
-                if elapsed > timeout:
-                    break
-                time.sleep(step)
-                elapsed += step
-            battery.shutdown()
+        # run the drivers in a background thread, errors are re-raised here once it is done
+        errors = []
 
-        watchdog = Thread(target=watchdog_fcn)
-        watchdog.start()
+        def run_battery():
+            # noinspection PyBroadException
+            try:
+                battery.start(block=True, quiet=False)
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                # wake up the waiting thread, there won't be any info coming after this
+                info_ready.set()
+
+        self.logger.debug(f"Trying to communicate with {res.device}...")
+        reader = Thread(target=run_battery, daemon=True)
+        reader.start()
+
+        # wait for the info to be read (or time out)
+        info_ready.wait(timeout=BATTERY_INFO_TIMEOUT)
+        battery.shutdown()
+        reader.join(timeout=1)
 
         try:
-            self.logger.debug(f"Trying to communicate with {res}...")
-            battery.start(block=True, quiet=False)
+            if errors:
+                raise errors[0]
         except (OSError, serial.serialutil.SerialException) as e:
             if "multiple access" in str(e):
                 # battery is busy
@@ -169,18 +285,13 @@ class UpgradeHelper(DTProcess):
                     "Battery detected but another process is using it. "
                     "Make sure no other process communicates with the battery."
                 ))
-                battery.shutdown()
                 return ExitCode.HARDWARE_BUSY
             # ---
             self.logger.error(
                 "An error occurred while talking to the battery, make sure "
                 "no other processes are communicating with the battery.")
-            battery.shutdown()
             return ExitCode.GENERIC_ERROR
 
-        # if we are here, either we got the info or we timed out
-        battery.shutdown()
-        watchdog.join()
         if battery.info is None:
             self.logger.error(
                 "An error occurred while talking to the battery, make sure "
@@ -239,12 +350,14 @@ class UpgradeHelper(DTProcess):
             Union[int, Tuple[int, str]]: If success, return (latest_fw_ver_int, latest_fw_ver_str).
                                          Otherwise, non-SUCCESS ExitCodes.
         """
+        forced_fw_version = os.environ.get(ENV_KEY_FORCE_FW_VERSION)
+        pcb_version = os.environ.get(ENV_KEY_PCB_VERSION)
 
         # method 1
-        if os.environ.get(ENV_KEY_FORCE_FW_VERSION, default=None) is not None:
-            latest_str = os.environ.get(ENV_KEY_FORCE_FW_VERSION, default=None)
+        if forced_fw_version is not None:
+            latest_str = forced_fw_version
             try:
-                latest_int = int(re.sub("[^0-9]+", "", latest_str))
+                latest_int = int(_NONDIGIT_RE.sub("", latest_str))
                 self.logger.info(f"Firmware version forced to {latest_str}")
                 return latest_int, latest_str
             except ValueError:
@@ -253,6 +366,9 @@ class UpgradeHelper(DTProcess):
                 return ExitCode.GENERIC_ERROR
 
         def fetch_latest_fw(pcb_version: int):
+            # reuse what we already fetched for this pcb version
+            if pcb_version in self._latest_fw:
+                return self._latest_fw[pcb_version]
             # get latest version available for a particular pcb version
             latest_int, latest_str = self._get_latest_battery_firmware_available_for_pcb(pcb_version=pcb_version)
             if latest_int is None:
@@ -261,11 +377,12 @@ class UpgradeHelper(DTProcess):
                                 "from the internet. Exiting.")
                 return ExitCode.GENERIC_ERROR
             self.logger.debug(f"Latest version fetched from the cloud is {latest_str}")
+            self._latest_fw[pcb_version] = latest_int, latest_str
             return latest_int, latest_str
 
         # method 2.a
-        if os.environ.get(ENV_KEY_PCB_VERSION) is not None:
-            pcb_ver = int(os.environ.get(ENV_KEY_PCB_VERSION))
+        if pcb_version is not None:
+            pcb_ver = int(pcb_version)
             self.logger.info(f"PCB version supplied: {pcb_ver}")
             return fetch_latest_fw(pcb_version=pcb_ver)
 
@@ -290,7 +407,7 @@ class UpgradeHelper(DTProcess):
             return res
         # now the self._battery_info contains the firmware version
         current_str = self._battery_info['version']
-        current_int = int(re.sub("[^0-9]+", "", current_str))
+        current_int = int(_NONDIGIT_RE.sub("", current_str))
 
         # get latest firmware for this version of PCB
         res = self._battery_get_latest_firmware_version()
@@ -309,18 +426,43 @@ class UpgradeHelper(DTProcess):
                         dryrun: bool = False,
                         use_local_firmware: bool = False,
                         ) -> int:
+        pcb_version = os.environ.get(ENV_KEY_PCB_VERSION)
+        # the battery cannot be queried in BOOT mode, but we might have read it before (see --serve)
+        if pcb_version is None and self._battery_info is not None:
+            pcb_version = str(int(self._battery_info['boot']['pcb_version']))
+
+        prefetcher, prefetched = None, {}
+        if not use_local_firmware:
+            # the PCB version has to be known
+            if pcb_version is None:
+                self.logger.error(f"{ENV_KEY_PCB_VERSION} env variable not given. Abort.")
+                return ExitCode.GENERIC_ERROR
+            # look up the latest firmware on the server while we look for the battery; the lookup
+            # runs on a daemon thread and neither logs nor writes to disk, so if we give up on it
+            # (e.g. no battery) it does not delay the exit, report anything or leave files behind
+            pcb_ver = int(pcb_version)
+            if os.environ.get(ENV_KEY_FORCE_FW_VERSION) is None and pcb_ver not in self._latest_fw:
+
+                def prefetch_latest_fw():
+                    # noinspection PyBroadException
+                    try:
+                        prefetched["result"] = self._fetch_latest_battery_firmware(pcb_ver)
+                    except BaseException as e:
+                        prefetched["error"] = e
+
+                prefetcher = Thread(target=prefetch_latest_fw, daemon=True)
+                prefetcher.start()
 
         res = self._battery_device_mode_detect(mode_required=BatteryMode.BOOT)
-        if isinstance(res, int):  # failed with ExitCode
-            return res
-        # res contains the boot mode device addr
-        dev_addr = res
+        if res.exit_code is not None:
+            return res.exit_code
+        # res.device contains the boot mode device addr
+        dev_addr = res.device
 
-        # try opening connection to it
+        # make sure we can open the device (it may have gone away, or be opened in exclusive mode)
         try:
-            with serial.Serial(dev_addr, BATTERY_PCB_BAUD_RATE) as _:
-                pass
-        except (OSError, serial.serialutil.SerialException):
+            os.close(os.open(dev_addr, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK))
+        except OSError:
             # battery is busy
             self.logger.error("Battery detected but another process is using it. This should not "
                               "have happened. Contact the administrator.")
@@ -334,29 +476,27 @@ class UpgradeHelper(DTProcess):
                 self.logger.info(f"Error! Local firmware binary NOT FOUND at: {fw_fpath}")
                 return ExitCode.GENERIC_ERROR
         else:  # download latest firmware
-            # the env variable PCB_VERSION has to be set
-            if os.environ.get(ENV_KEY_PCB_VERSION) is None:
-                self.logger.error(f"{ENV_KEY_PCB_VERSION} env variable not given. Abort.")
-                return ExitCode.GENERIC_ERROR
+            if prefetcher is not None:
+                prefetcher.join()
+                if "error" in prefetched:
+                    self._log_latest_battery_firmware_error(pcb_ver, prefetched["error"])
+                    self.logger.error("Error fetching the latest firmware version available "
+                                      "from the internet. Exiting.")
+                    return ExitCode.GENERIC_ERROR
+                self._latest_fw[pcb_ver] = self._cache_latest_battery_firmware(
+                    pcb_ver, *prefetched["result"])
 
             res = self._battery_get_latest_firmware_version()
             if isinstance(res, int):  # failed
                 return res
             latest_int, latest_str = res
 
-            pcb_ver = int(os.environ.get(ENV_KEY_PCB_VERSION))
             fw_filename = f"battery_pcb{pcb_ver}_fw_v{latest_int}.bin"
-            fw_fpath = f"/tmp/{fw_filename}"
+            fw_fpath = os.path.join(self._firmware_download_dir(), fw_filename)
             url = BATTERY_FIRMWARE_URL.format(pcb_version=pcb_ver, resource=fw_filename)
             self.logger.info(f"Downloading firmware version {latest_str}...")
             try:
-                with open(fw_fpath, "wb") as fout:
-                    # noinspection PyBroadException
-                    try:
-                        fout.write(requests.get(url).content)
-                    except BaseException as e:
-                        self.logger.error(f"ERROR: {str(e)}")
-                        return ExitCode.GENERIC_ERROR
+                self._download_parallel(url, fw_fpath)
                 self.logger.info("Firmware downloaded!")
             except Exception:
                 self.logger.error(f"Failed to download firmware. Error: {traceback.format_exc()}")
@@ -381,7 +521,14 @@ class UpgradeHelper(DTProcess):
         except subprocess.CalledProcessError:
             self.logger.info("An error occurred while flashing the battery.")
             return ExitCode.GENERIC_ERROR
+        finally:
+            # downloaded firmware lives in RAM (tmpfs), do not keep it around
+            if not use_local_firmware and os.path.isfile(fw_fpath):
+                os.unlink(fw_fpath)
         # ---
+        if not dryrun:
+            # the battery now runs a different firmware, what we know about it is stale
+            self._battery_info = None
         self.logger.info(f"Done!")
         return ExitCode.SUCCESS
 
@@ -390,22 +537,178 @@ class UpgradeHelper(DTProcess):
         return ExitCode.NOTHING_TO_DO
 
     @staticmethod
-    def _find_device(vid: str, pid: str) -> List[str]:
-        vid_pid_match = "VID:PID={}:{}".format(vid, pid)
-        ports = serial_grep(vid_pid_match)
-        return [p.device for p in ports]  # ['/dev/ttyACM0', ...]
+    def _list_ports_by_vidpid(wanted: Set[Tuple[str, str]]) -> Dict[Tuple[str, str], List[str]]:
+        from serial.tools.list_ports import comports
+
+        # scan the serial ports only once and group them by the (VID, PID) pairs we want
+        found = {vidpid: [] for vidpid in wanted}
+        lookup = {(vid.lower(), pid.lower()): (vid, pid) for vid, pid in wanted}
+        for p in comports():
+            if p.vid is None:
+                continue
+            vidpid = lookup.get((f"{p.vid:04x}", f"{p.pid:04x}"))
+            if vidpid is not None:
+                found[vidpid].append(p.device)
+        return found  # {(vid, pid): ['/dev/ttyACM0', ...], ...}
+
+    @staticmethod
+    def _firmware_download_dir() -> str:
+        # prefer RAM-backed storage, the firmware is only needed until it is flashed
+        for dpath in FIRMWARE_DOWNLOAD_DIRS:
+            if os.path.isdir(dpath) and os.access(dpath, os.W_OK):
+                return dpath
+        return FIRMWARE_DOWNLOAD_DIRS[-1]
+
+    @staticmethod
+    def _download_parallel(url: str, fpath: str, n: int = DOWNLOAD_MAX_CONCURRENCY):
+        """Download a file in parts using up to `n` concurrent range requests
+
+        The first request asks for the first part only, its response tells us the size
+        of the file. Files that fit in one part, and servers that ignore ranges, are
+        downloaded with that single request. If the download fails, the file is removed.
+        """
+        step = DOWNLOAD_CHUNK_SIZE
+        fd = os.open(fpath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+
+            def fetch(start: int, end: int, first: bool = False) -> Tuple[int, int]:
+                headers = {"Range": f"bytes={start}-{end}"}
+                with _session().get(url, headers=headers, stream=True, timeout=HTTP_TIMEOUT) as r:
+                    r.raise_for_status()
+                    if r.status_code == 206:
+                        # e.g., "bytes 0-1048575/3500000"
+                        size = int(r.headers["Content-Range"].rsplit("/", 1)[1])
+                    elif first:
+                        # the server ignored the range, we get the whole file instead
+                        size = int(r.headers.get("Content-Length", 0))
+                    else:
+                        raise IOError(f"The server stopped honoring range requests for {url}")
+                    if first and size > 0:
+                        os.posix_fallocate(fd, 0, size)
+                    offset = start
+                    for chunk in r.iter_content(step):
+                        os.pwrite(fd, chunk, offset)
+                        offset += len(chunk)
+                if r.status_code == 206 and offset != min(end + 1, size):
+                    raise IOError(f"Incomplete download of bytes {start}-{end} from {url}")
+                if r.status_code != 206 and size > 0 and offset != size:
+                    raise IOError(f"Incomplete download of {url}, got {offset} of {size} bytes")
+                return size, r.status_code
+
+            size, status = fetch(0, step - 1, first=True)
+            if status != 206:
+                return
+            # fetch the remaining parts of (at most) DOWNLOAD_CHUNK_SIZE bytes
+            ranges = [(a, min(a + step, size) - 1) for a in range(step, size, step)]
+            if not ranges:
+                return
+            with ThreadPoolExecutor(max_workers=min(n, len(ranges))) as pool:
+                jobs = [pool.submit(fetch, a, b) for a, b in ranges]
+                for job in jobs:
+                    job.result()
+        except BaseException:
+            # never leave a partial (preallocated) file behind, it may be taking up RAM
+            os.unlink(fpath)
+            raise
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _read_firmware_index_cache(fpath: str) -> Optional[dict]:
+        # noinspection PyBroadException
+        try:
+            with open(fpath, "rt") as fin:
+                cached = json.load(fin)
+            return cached if str(cached.get("latest", "")).isdigit() else None
+        except Exception:
+            return None
 
     @staticmethod
+    def _write_firmware_index_cache(fpath: str, content: dict):
+        # the cache is only an optimization, never fail because of it
+        # noinspection PyBroadException
+        try:
+            dpath = os.path.dirname(fpath)
+            os.makedirs(dpath, exist_ok=True)
+            # write a temporary file and move it in place, readers never see a partial file
+            fd, tmp_fpath = tempfile.mkstemp(dir=dpath, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wt") as fout:
+                    json.dump(content, fout)
+                os.replace(tmp_fpath, fpath)
+            except BaseException:
+                os.unlink(tmp_fpath)
+                raise
+        except Exception:
+            pass
+
     def _get_latest_battery_firmware_available_for_pcb(
+        self,
         pcb_version: int,
     ) -> Tuple[Optional[int], Optional[str]]:
-        url = BATTERY_FIRMWARE_URL.format(pcb_version=pcb_version, resource="latest")
         # noinspection PyBroadException
         try:
-            latest = requests.get(url).text
-        except BaseException:
-            traceback.print_exc()
+            return self._cache_latest_battery_firmware(
+                pcb_version, *self._fetch_latest_battery_firmware(pcb_version))
+        except BaseException as e:
+            self._log_latest_battery_firmware_error(pcb_version, e)
             return None, None
-        # ---
+
+    def _cache_latest_battery_firmware(
+        self,
+        pcb_version: int,
+        latest: str,
+        cache_entry: Optional[dict],
+    ) -> Tuple[int, str]:
+        # stores the entry returned by _fetch_latest_battery_firmware (if any) in the disk cache
+        if cache_entry is not None:
+            self._write_firmware_index_cache(self._firmware_index_cache_path(pcb_version), cache_entry)
         major, minor, patch, *_ = latest + "000"
         return int(latest), f"v{major}.{minor}.{patch}"
+
+    @staticmethod
+    def _firmware_index_cache_path(pcb_version: int) -> str:
+        return os.path.expanduser(BATTERY_FIRMWARE_INDEX_CACHE.format(pcb_version=pcb_version))
+
+    def _log_latest_battery_firmware_error(self, pcb_version: int, error: BaseException):
+        import requests
+        from urllib3.exceptions import ReadTimeoutError
+
+        # once the retries are exhausted, read timeouts surface as a ConnectionError
+        # wrapping a MaxRetryError whose reason is the ReadTimeoutError
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        if isinstance(error, requests.Timeout) or \
+                (isinstance(error, requests.ConnectionError) and
+                 isinstance(reason, ReadTimeoutError)):
+            url = BATTERY_FIRMWARE_URL.format(pcb_version=pcb_version, resource="latest")
+            self.logger.error(f"Timed out while fetching {url}")
+        else:
+            traceback.print_exception(type(error), error, error.__traceback__)
+
+    def _fetch_latest_battery_firmware(self, pcb_version: int) -> Tuple[str, Optional[dict]]:
+        # returns the latest version (e.g. "123") and the new cache entry, None if the cached one
+        # is still valid. It raises on error, does not log and does not write to disk, so it is
+        # safe to call from a background thread (see _cache_latest_battery_firmware)
+        url = BATTERY_FIRMWARE_URL.format(pcb_version=pcb_version, resource="latest")
+        cached = self._read_firmware_index_cache(self._firmware_index_cache_path(pcb_version))
+        # only download the index if it changed since we cached it
+        headers = {}
+        if cached is not None:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+        with _session().get(url, headers=headers, stream=True, timeout=HTTP_TIMEOUT) as r:
+            r.raise_for_status()
+            if r.status_code == 304:
+                # the index did not change since we cached it
+                return str(cached["latest"]), None
+            latest = r.text.strip()
+            # only cache values we can parse
+            if not latest.isdigit():
+                raise ValueError(f"Invalid firmware version '{latest}' from {url}")
+            return latest, {
+                "latest": latest,
+                "etag": r.headers.get("ETag"),
+                "last_modified": r.headers.get("Last-Modified"),
+            }
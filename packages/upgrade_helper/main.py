@@ -2,8 +2,6 @@
 
 import argparse
 
-from .helper import UpgradeHelper
-
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description=(
@@ -13,44 +11,24 @@ if __name__ == '__main__':
         "for downloading the correct version of firmware."
     ))
     # define parser arguments
-    parser.add_argument(
-        "--battery",
-        action="store_true",
-        default=False,
-        help="Whether to update the battery's firmware"
-    )
-    parser.add_argument(
-        "--hut",
-        action="store_true",
-        default=False,
-        help="Whether to update the HUT's firmware"
-    )
-    parser.add_argument(
-        "--find-pcbid",
-        action="store_true",
-        default=False,
-        help="Identify the PCB version"
-    )
-    parser.add_argument(
-        "--check",
-        action="store_true",
-        default=False,
-        help="Check if an update is needed"
-    )
-    parser.add_argument(
-        "--dry-run",
-        action="store_true",
-        default=False,
-        help="Pretend you are doing stuff"
-    )
-    parser.add_argument(
-        "--use-local-firmware",
-        action="store_true",
-        default=False,
-        help="Try to use the firmware at assets/firmware/fw.bin (to help fast testing with local firmware binaries)"
-    )
+    hardware = parser.add_mutually_exclusive_group()
+    action = parser.add_mutually_exclusive_group()
+    for target, name, help_text in [
+        (hardware, "battery", "Whether to update the battery's firmware"),
+        (hardware, "hut", "Whether to update the HUT's firmware"),
+        (action, "find-pcbid", "Identify the PCB version"),
+        (action, "check", "Check if an update is needed"),
+        (action, "serve", "Read battery commands (find-pcbid, check, upgrade, quit) from stdin, "
+                          "one per line, reusing the battery info and firmware index across commands"),
+        (parser, "dry-run", "Pretend you are doing stuff"),
+        (parser, "use-local-firmware", "Try to use the firmware at assets/firmware/fw.bin "
+                                       "(to help fast testing with local firmware binaries)"),
+    ]:
+        target.add_argument(f"--{name}", action="store_true", default=False, help=help_text)
     parsed = parser.parse_args()
     # ---
+    # imported here so that --help and invalid arguments do not pay for it
+    from .helper import UpgradeHelper
     # run upgrade helper
     app = UpgradeHelper()
     exit_code = app.start(parsed)
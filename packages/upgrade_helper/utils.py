@@ -1,19 +1,87 @@
-import re
+import glob
+import os
+import shutil
 import subprocess
-from typing import List, Dict
+import time
+from typing import List, NamedTuple
 
-LSUSB_REGEX = r"Bus\s+(?P<bus>\d+)\s+Device\s+(?P<device>\d+).+ID\s(?P<id>\w+:\w+)\s(?P<tag>.+)$"
+SYSFS_USB_DEVICES_DIR = "/sys/bus/usb/devices"
+# resolved once, so that every call does not need to search the PATH
+LSUSB_BIN = shutil.which("lsusb") or "/usr/bin/lsusb"
 
+# seconds for which the list of USB devices is reused by consecutive calls
+USB_DEVICES_CACHE_TTL = 1.0
+_cache = {'ts': 0.0, 'val': None}
 
-def get_usb_devices() -> List[Dict[str, str]]:
-    device_re = re.compile(LSUSB_REGEX, re.I)
-    df = subprocess.check_output("lsusb").decode('utf-8')
+
+class UsbDevice(NamedTuple):
+    device: str  # e.g., "/dev/bus/usb/001/005"
+    bus: int     # e.g., 1
+    devnum: int  # e.g., 5
+    id: str      # "<vendor id>:<product id>", e.g., "239a:000f"
+
+
+def get_usb_devices(force: bool = False) -> List[UsbDevice]:
+    now = time.monotonic()
+    # the cache holds a tuple and every caller gets its own list, so callers cannot alter it
+    if not force and _cache['val'] is not None and now - _cache['ts'] < USB_DEVICES_CACHE_TTL:
+        return list(_cache['val'])
+    # read the USB devices straight from sysfs when available, it is much cheaper than running lsusb
+    if os.path.isdir(SYSFS_USB_DEVICES_DIR):
+        devices = _get_usb_devices_from_sysfs()
+    else:
+        devices = _get_usb_devices_from_lsusb()
+    _cache['ts'] = now
+    _cache['val'] = tuple(devices)
+    return devices
+
+
+def _get_usb_devices_from_sysfs() -> List[UsbDevice]:
+    devices = []
+    _append = devices.append
+    # only devices have an `idVendor` file, interfaces (e.g. `1-1:1.0`) do not
+    for vid_fpath in sorted(glob.glob(os.path.join(SYSFS_USB_DEVICES_DIR, "*", "idVendor"))):
+        dpath = os.path.dirname(vid_fpath)
+        try:
+            bus = int(_read_sysfs_attr(dpath, "busnum"))
+            dev = int(_read_sysfs_attr(dpath, "devnum"))
+            vid = _read_sysfs_attr(dpath, "idVendor")
+            pid = _read_sysfs_attr(dpath, "idProduct")
+        except (OSError, ValueError):
+            # the device went away while we were reading it
+            continue
+        _append(UsbDevice(
+            device=f'/dev/bus/usb/{bus:03d}/{dev:03d}',
+            bus=bus,
+            devnum=dev,
+            id=f'{vid}:{pid}',
+        ))
+    return devices
+
+
+def _read_sysfs_attr(dpath: str, name: str) -> str:
+    with open(os.path.join(dpath, name), "rt") as fin:
+        return fin.read().strip()
+
+
+def _get_usb_devices_from_lsusb() -> List[UsbDevice]:
     devices = []
-    for i in df.split('\n'):
-        if i:
-            info = device_re.match(i)
-            if info:
-                dinfo = info.groupdict()
-                dinfo['device'] = '/dev/bus/usb/%s/%s' % (dinfo.pop('bus'), dinfo.pop('device'))
-                devices.append(dinfo)
+    _append = devices.append
+    # parse the output of lsusb line by line, as it comes
+    # e.g., "Bus 001 Device 005: ID 239a:000f Adafruit Industries Duckietown Battery"
+    with subprocess.Popen([LSUSB_BIN], stdout=subprocess.PIPE, encoding='utf-8') as proc:
+        for i in proc.stdout:
+            # skip anything that is not a device line (e.g., errors) before splitting it
+            if not i.startswith('Bus '):
+                continue
+            parts = i.rstrip('\n').split(None, 6)
+            if len(parts) < 6 or parts[2] != 'Device' or parts[4] != 'ID':
+                continue
+            try:
+                bus, dev = int(parts[1]), int(parts[3].rstrip(':'))
+            except ValueError:
+                continue
+            _append(UsbDevice(device=f'/dev/bus/usb/{bus:03d}/{dev:03d}', bus=bus, devnum=dev, id=parts[5]))
+        if proc.wait() != 0:
+            raise subprocess.CalledProcessError(proc.returncode, proc.args)
     return devices